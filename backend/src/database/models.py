@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, JSON
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -38,33 +38,46 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients list - stored as a JSON column so the driver
+    # handles (de)serialization once instead of a loads per read
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    recipe =  Column(JSON, nullable=False)
+
+    # per-instance memo of the short()/long() dicts, reset whenever the
+    # row is written so a stale representation is never returned
+    _short_cache = None
+    _long_cache = None
+
+    def _clear_repr_cache(self):
+        self._short_cache = None
+        self._long_cache = None
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': short_recipe
-        }
+        if self._short_cache is None:
+            short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in self.recipe]
+            self._short_cache = {
+                'id': self.id,
+                'title': self.title,
+                'recipe': short_recipe
+            }
+        return self._short_cache
 
     '''
     long()
         long form representation of the Drink model
     '''
     def long(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': json.loads(self.recipe)
-        }
+        if self._long_cache is None:
+            self._long_cache = {
+                'id': self.id,
+                'title': self.title,
+                'recipe': self.recipe
+            }
+        return self._long_cache
 
     '''
     insert()
@@ -76,6 +89,7 @@ class Drink(db.Model):
             drink.insert()
     '''
     def insert(self):
+        self._clear_repr_cache()
         db.session.add(self)
         db.session.commit()
 
@@ -88,6 +102,7 @@ class Drink(db.Model):
             drink.delete()
     '''
     def delete(self):
+        self._clear_repr_cache()
         db.session.delete(self)
         db.session.commit()
 
@@ -101,6 +116,7 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
+        self._clear_repr_cache()
         db.session.commit()
 
     def __repr__(self):
@@ -0,0 +1,15 @@
+'''
+wsgi entry point for serving the api under gunicorn with gevent
+workers. the monkey patching must run before anything else imports
+socket/ssl, so all blocking I/O (database, Auth0 JWKS fetch) yields
+to other greenlets instead of stalling the worker.
+run with:
+    gunicorn -k gevent -w 4 --worker-connections 1000 wsgi:app
+'''
+from gevent import monkey
+monkey.patch_all()
+
+from src.api import app  # noqa: E402
+
+if __name__ == '__main__':
+    app.run()